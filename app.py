@@ -1,18 +1,26 @@
 # app.py
 # Minimal Streamlit admin for Standvirtual scraper + SQLite explorer
 
-import sqlite3
-from pathlib import Path
-
 import pandas as pd
 import streamlit as st
-import altair as alt
 import numpy as np
 import os
 
-from db import DB_PATH, SCHEMA_PATH, connect  # points to "scraper.db" and "schema.sql"
 from db import backfill_cars_region_ids
-from db import IS_PG
+from db_helpers import (
+    cat_options,
+    classify_columns,
+    db_mtime,
+    distinct_values,
+    ensure_db,
+    list_tables,
+    numeric_bounds,
+    numeric_bounds_generic,
+    ols_sql,
+    read_schema_generic,
+    read_table,
+    read_table_generic,
+)
 from standvirtual import run_scrape
 
 if "DATABASE_URL" in st.secrets:
@@ -20,92 +28,22 @@ if "DATABASE_URL" in st.secrets:
 
 st.set_page_config(page_title="RickyScrape", layout="wide")
 
-# --- ensure DB exists / schema is applied (read-only safe if already there)
-def ensure_db():
-    con = connect()
-    if not IS_PG:
-        with con:
-            con.executescript(Path(SCHEMA_PATH).read_text(encoding="utf-8"))
-    return con
-
-# --- small helpers
-@st.cache_data(show_spinner=False)
-def list_tables():
-    con = connect()
-    if IS_PG:
-        q = "SELECT tablename AS name FROM pg_catalog.pg_tables WHERE schemaname='public' ORDER BY tablename;"
-    else:
-        q = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name;"
-    df = pd.read_sql_query(q, con)
-    con.close()
-    return df["name"].tolist()
-
-
-@st.cache_data(show_spinner=False)
-def read_schema_generic(table: str):
-    con = connect()
-    if IS_PG:
-        q = """
-        SELECT column_name, data_type, is_nullable, column_default
-        FROM information_schema.columns
-        WHERE table_schema='public' AND table_name=%s
-        ORDER BY ordinal_position;
-        """
-        df = pd.read_sql_query(q, con, params=(table,))
-    else:
-        df = pd.read_sql_query(f"PRAGMA table_info({table});", con)
-    con.close()
-    return df
-
-
-@st.cache_data(show_spinner=False)
-def read_table_generic(table: str, limit: int = 1000, order_by: str | None = None, order_dir: str = "DESC"):
-    con = connect()
-    q = f"SELECT * FROM {table}"
-    if order_by:
-        q += f" ORDER BY {order_by} {order_dir}"
-    q += f" LIMIT {int(limit)}"
-    df = pd.read_sql_query(q, con)
-    con.close()
-    return df
-
-
-@st.cache_data(show_spinner=False)
-def read_table(limit=1000, filters=None, order_by=None, order_dir="DESC"):
-    con = connect()
-    q = "SELECT * FROM cars"
-    clauses = []
-    params = []
-    if filters:
-        ph = "%s" if IS_PG else "?"
-        for col, value in filters.items():
-            if value:
-                clauses.append(f"{col} LIKE {ph}")
-                params.append(f"%{value}%")
-    if clauses:
-        q += " WHERE " + " AND ".join(clauses)
-    if order_by:
-        q += f" ORDER BY {order_by} {order_dir}"
-    q += f" LIMIT {int(limit)}"
-    df = pd.read_sql_query(q, con, params=params if params else None)
-    con.close()
-    return df
-
-
-@st.cache_data(show_spinner=False)
-def read_schema():
-    con = connect()
-    if IS_PG:
-        df = pd.read_sql_query("""
-            SELECT column_name, data_type, is_nullable, column_default
-            FROM information_schema.columns
-            WHERE table_schema='public' AND table_name='cars'
-            ORDER BY ordinal_position;
-        """, con)
-    else:
-        df = pd.read_sql_query("PRAGMA table_info(cars);", con)
-    con.close()
-    return df
+
+def is_intlike(series: pd.Series, arr: np.ndarray | None = None) -> bool:
+    """
+    Should this column get an integer slider?
+
+    Integer dtypes answer in O(1); float columns pay one vectorized floor
+    comparison on the raw array. Pass `arr` when the float64 view was
+    already materialized (the Explore tab keeps one per column) to skip
+    the conversion.
+    """
+    if pd.api.types.is_integer_dtype(series) or series.dtype.kind in "iu":
+        return True
+    if arr is None:
+        arr = series.to_numpy(dtype="float64", na_value=np.nan)
+    finite = arr[np.isfinite(arr)]
+    return bool(np.all(finite == np.floor(finite)))
 
 
 def apply_categorical_filters(df: pd.DataFrame, key_prefix: str = "catf_") -> pd.DataFrame:
@@ -125,13 +63,17 @@ def apply_categorical_filters(df: pd.DataFrame, key_prefix: str = "catf_") -> pd
         return df  # nothing to filter
 
     st.markdown("#### Filters (categorical)")
-    fdf = df.copy()
 
     # Use a compact two-column layout to avoid vertical bloat (optional)
     cols = st.columns(2) if len(cat_cols) > 1 else [st]
 
+    # One fused mask, one slice at the end — no upfront copy, no per-filter
+    # intermediate frames.
+    mask = np.ones(len(df), dtype=bool)
+    narrowed = False
+
     for i, col in enumerate(cat_cols):
-        options = sorted([v for v in fdf[col].dropna().unique()])
+        options = sorted([v for v in df[col].dropna().unique()])
         # Default to all values selected
         default_vals = options
         # Put widgets in alternating columns for compactness
@@ -144,9 +86,10 @@ def apply_categorical_filters(df: pd.DataFrame, key_prefix: str = "catf_") -> pd
                 help="Filter the plot data by this category"
             )
         if selected and len(selected) < len(options):
-            fdf = fdf[fdf[col].isin(selected)]
+            mask &= df[col].isin(selected).to_numpy()
+            narrowed = True
 
-    return fdf
+    return df.loc[mask] if narrowed else df
 
 # --- UI
 st.title("Standvirtual Scraper Admin")
@@ -194,7 +137,7 @@ with tab_scrape:
         c4.metric("Upserted", summary["upserted"])
 
         st.caption("Latest rows (by scraped_at)")
-        latest = read_table(limit=50, order_by="scraped_at", order_dir="DESC")
+        latest = read_table(limit=50, order_by="scraped_at", order_dir="DESC", mtime=db_mtime())
         st.dataframe(latest, use_container_width=True)
 
 
@@ -204,24 +147,19 @@ with tab_explore:
     ensure_db()
 
     # --- Table picker
-    tables = list_tables()
+    tables = list_tables(db_mtime())
     if not tables:
         st.info("No tables yet. Run a scrape first.")
     else:
         selected = st.selectbox("Table", options=tables, index=max(0, tables.index("cars")) if "cars" in tables else 0)
         st.caption(f"Showing: `{selected}`")
 
-        # Clear caches when table changes (so schema/rows update)
-        if "explore_last_table" not in st.session_state:
-            st.session_state.explore_last_table = selected
-        if st.session_state.explore_last_table != selected:
-            read_table_generic.clear()
-            read_schema_generic.clear()
-            st.session_state.explore_last_table = selected
+        # No cache juggling on table change: the helpers key on the table
+        # name, and read_table_generic keys on db_mtime() for data freshness.
 
         # --- Schema
         with st.expander("Table schema"):
-            schema_df = read_schema_generic(selected)
+            schema_df = read_schema_generic(selected, db_mtime())
             st.dataframe(schema_df, use_container_width=True)
 
         # --- Toolbar
@@ -243,79 +181,148 @@ with tab_explore:
                     st.success(f"Backfilled region_id for {n} rows")
                     st.rerun()
 
-        # --- Load rows
-        limit = st.slider("Max rows", 100, 5000, 1000, 100, key=f"lim_{selected}")
-        # Load once (unfiltered), then filter in pandas (generic)
-        df = read_table_generic(selected, limit=limit)
+        # --- Load rows (keyset pagination: "Load more" continues past the
+        # last seen key instead of re-reading everything with a bigger LIMIT)
+        limit = st.slider("Rows per page", 100, 5000, 1000, 100, key=f"lim_{selected}")
+        name_col = "name" if "name" in schema_df.columns else "column_name"
+        table_cols = schema_df[name_col].tolist()
+        default_order = next((c for c in ("scraped_at", "id") if c in table_cols), None)
+
+        # Ordering happens in SQL: the common order columns are indexed, so
+        # rows stream off the index already sorted — no pandas resort needed.
+        oc1, oc2 = st.columns([2, 1])
+        order_col = oc1.selectbox(
+            "Order by", options=table_cols,
+            index=table_cols.index(default_order) if default_order in table_cols else 0,
+            key=f"ob_{selected}",
+        )
+        order_dir = oc2.radio("Order direction", ["DESC", "ASC"], horizontal=True, key=f"od_{selected}")
+        pages_key = f"explore_pages_{selected}_{order_col}_{order_dir}"
+
+        # long text columns stay out of the preview projection — they
+        # dominate bytes per row and the grid truncates them anyway
+        heavy_cols = {"title", "description", "raw", "body"}
+        fetch_cols = tuple(c for c in table_cols if c not in heavy_cols) or None
+        if fetch_cols and order_col not in fetch_cols:
+            fetch_cols = fetch_cols + (order_col,)
+
+        # tie-break column for the keyset cursor: scraped_at has one-second
+        # resolution and a whole batch commits with one timestamp, so paging
+        # on the order column alone would skip the rest of a tied run
+        tie_col = next((c for c in ("listing_id", "id")
+                        if c in table_cols and c != order_col), None)
+        if fetch_cols and tie_col and tie_col not in fetch_cols:
+            fetch_cols = fetch_cols + (tie_col,)
+
+        df = read_table_generic(selected, limit=limit, order_by=order_col,
+                                order_dir=order_dir, mtime=db_mtime(),
+                                columns=fetch_cols, tie_by=tie_col)
+        extra_pages = st.session_state.get(pages_key, [])
+        if extra_pages:
+            df = pd.concat([df, *extra_pages], ignore_index=True)
+
+        if order_col and len(df):
+            if st.button("⬇️ Load more", key=f"more_{selected}",
+                         help=f"Fetch the next {limit} rows (keyset on {order_col})"):
+                last = df.iloc[-1]
+                cursor = ((last[order_col], last[tie_col]) if tie_col
+                          else last[order_col])
+                nxt = read_table_generic(selected, limit=limit, order_by=order_col,
+                                         order_dir=order_dir, mtime=db_mtime(),
+                                         cursor=cursor,
+                                         columns=fetch_cols, tie_by=tie_col)
+                if len(nxt):
+                    st.session_state.setdefault(pages_key, []).append(nxt)
+                    st.rerun()
+                else:
+                    st.toast("No more rows")
 
         # --- Generic filters (same pattern you already use in Analysis)
+        # Column classes come from the declared SQL types (cached once per
+        # table), not a select_dtypes walk over the frame on every rerun.
+        cat_cols_decl, num_cols_decl = classify_columns(selected)
         # Categorical multiselects
         cat_filters = {}
-        cat_cols = list(df.select_dtypes(include=["object", "category", "bool"]).columns)
         # Hide very long text fields from the filter UI
         hide_cats = {"url", "title"}
-        cat_cols = [c for c in cat_cols if c not in hide_cats]
-
-        if cat_cols:
-            with st.expander("Filters (categorical)"):
-                ccols = st.columns(2)
-                for i, col in enumerate(sorted(cat_cols)):
-                    opts = sorted([v for v in df[col].dropna().unique().tolist() if str(v).strip()])
-                    selected_opts = ccols[i % 2].multiselect(
-                        label=col,
-                        options=opts,
-                        default=opts,
-                        key=f"cat_{selected}_{col}",
-                    )
-                    if selected_opts and len(selected_opts) < len(opts):
-                        cat_filters[col] = set(selected_opts)
+        cat_cols = [c for c in cat_cols_decl if c in df.columns and c not in hide_cats]
 
-        # Numeric sliders
         num_filters = {}
-        num_cols_all = list(df.select_dtypes(include="number").columns)
-        if num_cols_all:
-            with st.expander("Filters (numeric)"):
-                cols = st.columns(2)
-                for i, col in enumerate(num_cols_all):
-                    series = df[col].dropna().astype(float)
-                    if series.empty:
-                        continue
-                    vmin, vmax = float(series.min()), float(series.max())
-                    is_intlike = (series % 1 == 0).all()
-                    if is_intlike:
-                        sel_min, sel_max = cols[i % 2].slider(
-                            f"{col}", min_value=int(vmin), max_value=int(vmax),
-                            value=(int(vmin), int(vmax)), step=1, key=f"num_{selected}_{col}"
-                        )
-                        num_filters[col] = (float(sel_min), float(sel_max))
-                    else:
-                        step = (vmax - vmin) / 100.0 if vmax > vmin else 1.0
-                        sel_min, sel_max = cols[i % 2].slider(
-                            f"{col}", min_value=vmin, max_value=vmax,
-                            value=(vmin, vmax), step=step, key=f"num_{selected}_{col}"
-                        )
-                        num_filters[col] = (sel_min, sel_max)
-
-        # Apply filters client-side
-        dff = df.copy()
-        for col, allowed in cat_filters.items():
-            if col in dff.columns:
-                dff = dff[dff[col].isin(allowed)]
-        for col, (lo, hi) in num_filters.items():
-            if col in dff.columns:
-                dff = dff[dff[col].notna()]
-                dff = dff[(dff[col].astype(float) >= float(lo)) & (dff[col].astype(float) <= float(hi))]
-
-        # Order by (pick from actual columns of this table)
-        order_by = st.selectbox("Order by", options=list(dff.columns), index=min(len(dff.columns)-1, 0) if not dff.columns.empty else 0, key=f"ob_{selected}")
-        order_dir = st.radio("Order direction", ["DESC", "ASC"], horizontal=True, key=f"od_{selected}")
-        if order_by:
-            dff = dff.sort_values(order_by, ascending=(order_dir == "ASC"), kind="mergesort")  # stable sort
+        num_cols_all = [c for c in num_cols_decl if c in df.columns]
+
+        # The whole filter block lives in one form: tweaking a multiselect or
+        # slider no longer reruns the script (and its SQL) per interaction —
+        # everything below re-executes once, on Apply.
+        if cat_cols or num_cols_all:
+            with st.form(f"filters_{selected}"):
+                if cat_cols:
+                    with st.expander("Filters (categorical)"):
+                        ccols = st.columns(2)
+                        opts_by_col = cat_options(selected, db_mtime(), tuple(sorted(cat_cols)))
+                        for i, col in enumerate(sorted(cat_cols)):
+                            opts = opts_by_col[col]
+                            selected_opts = ccols[i % 2].multiselect(
+                                label=col,
+                                options=opts,
+                                default=opts,
+                                key=f"cat_{selected}_{col}",
+                            )
+                            if selected_opts and len(selected_opts) < len(opts):
+                                cat_filters[col] = set(selected_opts)
+
+                # Numeric sliders
+                if num_cols_all:
+                    with st.expander("Filters (numeric)"):
+                        cols = st.columns(2)
+                        # slider bounds from one full-table aggregate — the page is a
+                        # LIMIT slice, so page-derived ranges miss rows past the limit
+                        bounds = numeric_bounds_generic(selected, db_mtime(), tuple(num_cols_all))
+                        # cast each column to a float array once, not once per use
+                        num_arrays = {c: df[c].to_numpy(dtype="float64", na_value=np.nan)
+                                      for c in num_cols_all}
+                        for i, col in enumerate(num_cols_all):
+                            vmin, vmax = bounds.get(col, (None, None))
+                            if vmin is None or vmax is None:
+                                continue
+                            vmin, vmax = float(vmin), float(vmax)
+                            if is_intlike(df[col], num_arrays[col]):
+                                sel_min, sel_max = cols[i % 2].slider(
+                                    f"{col}", min_value=int(vmin), max_value=int(vmax),
+                                    value=(int(vmin), int(vmax)), step=1, key=f"num_{selected}_{col}"
+                                )
+                                if (float(sel_min), float(sel_max)) != (vmin, vmax):
+                                    num_filters[col] = (float(sel_min), float(sel_max))
+                            else:
+                                step = (vmax - vmin) / 100.0 if vmax > vmin else 1.0
+                                sel_min, sel_max = cols[i % 2].slider(
+                                    f"{col}", min_value=vmin, max_value=vmax,
+                                    value=(vmin, vmax), step=step, key=f"num_{selected}_{col}"
+                                )
+                                if (sel_min, sel_max) != (vmin, vmax):
+                                    num_filters[col] = (sel_min, sel_max)
+                st.form_submit_button("Apply filters")
+
+        # Apply filters in SQL: only matching rows are fetched. The
+        # unfiltered df above is a cache hit, so this costs one extra query
+        # only when something is actually narrowed.
+        if cat_filters or num_filters:
+            dff = read_table_generic(
+                selected, limit=limit, order_by=order_col, order_dir=order_dir,
+                mtime=db_mtime(),
+                cat_filters={c: tuple(sorted(v)) for c, v in cat_filters.items()},
+                num_filters=num_filters,
+                columns=fetch_cols, tie_by=tie_col,
+            )
+        else:
+            dff = df
 
         st.dataframe(dff, use_container_width=True)
 
     
 with tab_analysis:
+    # altair is only needed here; deferring the import keeps it off the
+    # first-paint path (Python caches the module, so reruns pay nothing)
+    import altair as alt
 
     st.subheader("Scatter analysis")
     ensure_db()
@@ -327,90 +334,115 @@ with tab_analysis:
     a_col1, _ = st.columns([1, 9])
     with a_col1:
         if st.button("🔄 Reload data", key="analysis_reload", help="Clear cache and reload from database"):
+            # everything this tab renders from: rows, slider bounds,
+            # multiselect options, and the SQL regression fit
             read_table.clear()
+            numeric_bounds.clear()
+            distinct_values.clear()
+            ols_sql.clear()
             st.toast("Data reloaded")
             st.rerun()
 
-    # load data
-    df = read_table(limit=max_rows, order_by=None)
+    # load data (numeric + categorical + url only; the scatter needs no more)
+    # sampled server-side so the plot stays representative past the row cap
+    df = read_table(
+        limit=max_rows,
+        columns=("brand", "price", "mileage_km", "model_year", "fuel",
+                 "city", "region", "seller_type", "url"),
+        sample=True,
+        mtime=db_mtime(),
+    )
 
     # ---------- Categorical dropdown filters (auto) ----------
+    # column classes from the declared SQL types (cached), not select_dtypes
+    cat_cols_decl, num_cols_decl = classify_columns("cars")
     cat_filters = {}
-    cat_cols = list(df.select_dtypes(include=["object", "category", "bool"]).columns)
-
     # Optional: hide columns that aren't useful to filter on
     hide_cats = {"listing_id", "url", "title", "scraped_at"}
-    cat_cols = [c for c in cat_cols if c not in hide_cats]
-
-    if cat_cols:
-        st.markdown("### Categorical filters")
-        ccols = st.columns(2)
-        for i, col in enumerate(sorted(cat_cols)):
-            opts = sorted([v for v in df[col].dropna().unique().tolist() if str(v).strip()])
-            # default = all values selected
-            selected = ccols[i % 2].multiselect(
-                label=col,
-                options=opts,
-                default=opts,
-                help="Filter the plot data by this category"
-            )
-            # Only record a filter if the user narrowed it down
-            if selected and len(selected) < len(opts):
-                cat_filters[col] = set(selected)
+    cat_cols = [c for c in cat_cols_decl if c in df.columns and c not in hide_cats]
 
-    # ---------- Dynamic numeric range sliders ----------
     num_filters = {}
-    num_cols_all = list(df.select_dtypes(include="number").columns)
-
-    if num_cols_all:
-        st.markdown("### Filters")
-        cols = st.columns(2)  # lay sliders in two columns
-        for i, col in enumerate(num_cols_all):
-            series = df[col].dropna().astype(float)
-            if series.empty:
-                continue
-            vmin, vmax = float(series.min()), float(series.max())
-
-            # If column is integer-like, use int slider; else float slider
-            is_intlike = (series % 1 == 0).all()
-
-            if is_intlike:
-                sel_min, sel_max = cols[i % 2].slider(
-                    f"{col}",
-                    min_value=int(vmin),
-                    max_value=int(vmax),
-                    value=(int(vmin), int(vmax)),
-                    step=1,
-                )
-                num_filters[col] = (float(sel_min), float(sel_max))
-            else:
-                step = (vmax - vmin) / 100.0 if vmax > vmin else 1.0
-                sel_min, sel_max = cols[i % 2].slider(
-                    f"{col}",
-                    min_value=vmin,
-                    max_value=vmax,
-                    value=(vmin, vmax),
-                    step=step,
-                )
-                num_filters[col] = (sel_min, sel_max)
+    num_cols_all = [c for c in num_cols_decl if c in df.columns]
+
+    # Filters sit in a form: dragging a slider or toggling a multiselect no
+    # longer reruns the tab (mask, regression, chart) per interaction — the
+    # script re-executes once per Apply.
+    if cat_cols or num_cols_all:
+        with st.form("analysis_filters"):
+            if cat_cols:
+                st.markdown("### Categorical filters")
+                ccols = st.columns(2)
+                for i, col in enumerate(sorted(cat_cols)):
+                    opts = distinct_values(db_mtime(), col)
+                    # default = all values selected
+                    selected = ccols[i % 2].multiselect(
+                        label=col,
+                        options=opts,
+                        default=opts,
+                        help="Filter the plot data by this category"
+                    )
+                    # Only record a filter if the user narrowed it down
+                    if selected and len(selected) < len(opts):
+                        cat_filters[col] = set(selected)
+
+            # ---------- Dynamic numeric range sliders ----------
+            if num_cols_all:
+                st.markdown("### Filters")
+                cols = st.columns(2)  # lay sliders in two columns
+                bounds = numeric_bounds(db_mtime())
+                for i, col in enumerate(num_cols_all):
+                    # bounds come from one memoized SQL aggregate, not a column scan
+                    vmin, vmax = bounds.get(col, (None, None))
+                    if vmin is None or vmax is None:
+                        continue
+                    vmin, vmax = float(vmin), float(vmax)
+
+                    # If column is integer-like, use int slider; else float slider
+                    # Only record a filter when the range was actually
+                    # narrowed — full-range sliders would otherwise keep the
+                    # SQL regression path (ols_sql) permanently disabled.
+                    if is_intlike(df[col]):
+                        sel_min, sel_max = cols[i % 2].slider(
+                            f"{col}",
+                            min_value=int(vmin),
+                            max_value=int(vmax),
+                            value=(int(vmin), int(vmax)),
+                            step=1,
+                        )
+                        if (float(sel_min), float(sel_max)) != (vmin, vmax):
+                            num_filters[col] = (float(sel_min), float(sel_max))
+                    else:
+                        step = (vmax - vmin) / 100.0 if vmax > vmin else 1.0
+                        sel_min, sel_max = cols[i % 2].slider(
+                            f"{col}",
+                            min_value=vmin,
+                            max_value=vmax,
+                            value=(vmin, vmax),
+                            step=step,
+                        )
+                        if (sel_min, sel_max) != (vmin, vmax):
+                            num_filters[col] = (sel_min, sel_max)
+            st.form_submit_button("Apply filters")
 
 # ---------- Apply filters ----------
-    dff = df.copy()
+    # One fused boolean mask and a single slice, instead of rebuilding the
+    # frame once per filter (N filters used to mean N full copies).
+    mask = np.ones(len(df), dtype=bool)
 
-    # Apply categorical filters
     for col, allowed in cat_filters.items():
-        if col in dff.columns:
-            dff = dff[dff[col].isin(allowed)]
+        if col in df.columns:
+            mask &= df[col].isin(allowed).to_numpy()
 
-    # Apply numeric filters
     for col, (lo, hi) in num_filters.items():
-        if col in dff.columns:
-            dff = dff[dff[col].notna()]
-            dff = dff[(dff[col].astype(float) >= float(lo)) & (dff[col].astype(float) <= float(hi))]
+        if col in df.columns:
+            v = df[col].to_numpy(dtype="float64", na_value=np.nan)
+            mask &= np.isfinite(v) & (v >= float(lo)) & (v <= float(hi))
+
+    dff = df.loc[mask]
 
     # ---------- Plot (scatter + numpy linear regression line) ----------
     chart = None
-    num_cols = list(dff.select_dtypes(include="number").columns)
+    num_cols = [c for c in num_cols_decl if c in dff.columns]
 
     if len(num_cols) < 2:
         st.info("Not enough numeric columns to plot. Try scraping data first.")
@@ -436,8 +468,29 @@ with tab_analysis:
                 x_min, x_max = float(np.min(xs)), float(np.max(xs))
                 y_min, y_max = float(np.min(ys)), float(np.max(ys))
 
-                # --- numpy linear regression ---
-                m, b = np.polyfit(xs, ys, 1)       # slope, intercept
+                # --- linear regression ---
+                # unfiltered view: fit over the full table in SQL (five sums,
+                # zero rows fetched); with filters active, fit the plotted data
+                fit = None
+                if not cat_filters and not num_filters:
+                    fit = ols_sql(db_mtime(), x, y)
+                if fit is not None:
+                    m, b, r2 = fit
+                else:
+                    # closed-form 1-D OLS: a few dot-product reductions
+                    # instead of polyfit's Vandermonde matrix + SVD; R² falls
+                    # out of the same sums with no extra pass
+                    n = xs.size
+                    sx = float(xs.sum())
+                    sy = float(ys.sum())
+                    sxx = float(xs @ xs)
+                    sxy = float(xs @ ys)
+                    syy = float(ys @ ys)
+                    denom = n * sxx - sx * sx  # > 0: np.std(xs) checked above
+                    m = (n * sxy - sx * sy) / denom
+                    b = (sy - m * sx) / n
+                    var_y = n * syy - sy * sy
+                    r2 = (n * sxy - sx * sy) ** 2 / (denom * var_y) if var_y > 0 else float("nan")
                 x_line = np.linspace(x_min, x_max, 100)
                 y_line = m * x_line + b
 
@@ -448,41 +501,37 @@ with tab_analysis:
                 # Outlier controls
                 col_o1, col_o2 = st.columns([1, 2])
                 method = col_o1.selectbox("Outlier method", ["Z-score", "MAD (robust)"], index=1)
+                # scores are computed in-place in one scratch buffer so each
+                # step doesn't allocate another length-N temporary
+                buf = np.empty_like(residuals)
+                is_outlier = np.zeros(residuals.shape, dtype=bool)
                 if method == "Z-score":
                     thr = col_o2.slider("Z-score threshold", 1.0, 5.0, 3.0, 0.1)
                     std = float(np.std(residuals))
-                    z = residuals / std if std > 0 else np.zeros_like(residuals)
-                    is_outlier = np.abs(z) > thr
+                    if std > 0:
+                        np.fabs(residuals, out=buf)  # fabs: float-only fast path
+                        buf /= std
+                        np.greater(buf, thr, out=is_outlier)
                 else:
                     thr = col_o2.slider("MAD threshold (≈σ units)", 1.0, 7.0, 3.5, 0.1)
                     med = float(np.median(residuals))
-                    mad = float(np.median(np.abs(residuals - med)))
-                    mad_std = 1.4826 * mad  # ≈ std
-                    score = np.abs(residuals - med) / mad_std if mad_std > 0 else np.zeros_like(residuals)
-                    is_outlier = score > thr
-
-                # Build plotting DataFrame
-                plot_df = dff.loc[mask].copy()
+                    np.subtract(residuals, med, out=buf)
+                    np.fabs(buf, out=buf)
+                    mad_std = 1.4826 * float(np.median(buf))  # ≈ std
+                    if mad_std > 0:
+                        buf /= mad_std
+                        np.greater(buf, thr, out=is_outlier)
+
+                # Build plotting DataFrame — only the columns the chart uses;
+                # shipping every column per point bloats the Vega-Lite payload
+                tooltip_cols = [c for c in ("brand", "price", "mileage_km", "model_year", "url")
+                                if c in dff.columns]
+                keep = [c for c in dict.fromkeys((x, y, "url", *tooltip_cols))
+                        if c in dff.columns]
+                plot_df = dff.loc[mask, keep].copy()
                 plot_df["residual"] = residuals
                 plot_df["outlier"] = is_outlier
-                
-
-                # Scatter: clickable points (open listing), gray by default, red for outliers
-                scatter = (
-                    alt.Chart(plot_df)
-                    .mark_circle(size=60, opacity=0.7)
-                    .encode(
-                        x=alt.X(x, scale=alt.Scale(domain=[x_min, x_max])),
-                        y=alt.Y(y, scale=alt.Scale(domain=[y_min, y_max])),
-                        color=alt.Color(
-                            "outlier:N",
-                            scale=alt.Scale(domain=[False, True], range=["lightgray", "crimson"]),
-                            legend=alt.Legend(title="Outlier"),
-                        ),
-                        href=alt.Href("url:N"),  # <- make points clickable
-                        tooltip=[alt.Tooltip(c) for c in plot_df.columns],
-                    )
-                )
+
 
                 # Regression line (red)
                 line_df = pd.DataFrame({x: x_line, y: y_line})
@@ -492,12 +541,63 @@ with tab_analysis:
                     .encode(x=x, y=y)
                 )
 
-                chart = (scatter + reg_line).interactive()
-
-                # R² for reference
-                ss_res = float(np.sum((ys - y_pred) ** 2))
-                ss_tot = float(np.sum((ys - np.mean(ys)) ** 2))
-                r2 = 1.0 - ss_res / ss_tot if ss_tot > 0 else float("nan")
+                if xs.size > 2000:
+                    # Big scatters: bin server-side and ship ~bins² cells
+                    # instead of one JSON point per row — the Vega payload
+                    # stops scaling with the row cap. Real (clickable) points
+                    # survive only for the outliers.
+                    H, xe, ye = np.histogram2d(xs, ys, bins=80)
+                    nzx, nzy = np.nonzero(H)
+                    bin_df = pd.DataFrame({
+                        x: xe[nzx], "x2": xe[nzx + 1],
+                        y: ye[nzy], "y2": ye[nzy + 1],
+                        "count": H[nzx, nzy],
+                    })
+                    density = (
+                        alt.Chart(bin_df)
+                        .mark_rect(opacity=0.8)
+                        .encode(
+                            x=alt.X(x, scale=alt.Scale(domain=[x_min, x_max])),
+                            x2=alt.X2("x2"),
+                            y=alt.Y(y, scale=alt.Scale(domain=[y_min, y_max])),
+                            y2=alt.Y2("y2"),
+                            color=alt.Color(
+                                "count:Q",
+                                scale=alt.Scale(scheme="greys"),
+                                legend=alt.Legend(title="Cars"),
+                            ),
+                            tooltip=[alt.Tooltip("count:Q", title="cars")],
+                        )
+                    )
+                    outlier_pts = (
+                        alt.Chart(plot_df.loc[plot_df["outlier"]])
+                        .mark_circle(size=60, opacity=0.9, color="crimson")
+                        .encode(
+                            x=alt.X(x, scale=alt.Scale(domain=[x_min, x_max])),
+                            y=alt.Y(y, scale=alt.Scale(domain=[y_min, y_max])),
+                            href=alt.Href("url:N"),
+                            tooltip=[alt.Tooltip(c) for c in tooltip_cols],
+                        )
+                    )
+                    chart = (density + outlier_pts + reg_line).interactive()
+                else:
+                    # Scatter: clickable points (open listing), gray by default, red for outliers
+                    scatter = (
+                        alt.Chart(plot_df)
+                        .mark_circle(size=60, opacity=0.7)
+                        .encode(
+                            x=alt.X(x, scale=alt.Scale(domain=[x_min, x_max])),
+                            y=alt.Y(y, scale=alt.Scale(domain=[y_min, y_max])),
+                            color=alt.Color(
+                                "outlier:N",
+                                scale=alt.Scale(domain=[False, True], range=["lightgray", "crimson"]),
+                                legend=alt.Legend(title="Outlier"),
+                            ),
+                            href=alt.Href("url:N"),  # <- make points clickable
+                            tooltip=[alt.Tooltip(c) for c in tooltip_cols],
+                        )
+                    )
+                    chart = (scatter + reg_line).interactive()
 
                 st.altair_chart(chart, use_container_width=True)
                 st.caption(
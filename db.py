@@ -15,17 +15,34 @@ def connect():
     if IS_PG:
         import psycopg  # psycopg[binary]
         return psycopg.connect(DATABASE_URL)
-    return sqlite3.connect(DB_PATH)
+    con = sqlite3.connect(DB_PATH)
+    # WAL + NORMAL: commits stop fsyncing the rollback journal (readers keep
+    # working during writes); mmap/cache keep hot pages out of syscalls
+    con.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA mmap_size=268435456;"
+        "PRAGMA cache_size=-65536;"
+    )
+    return con
 
 def _q(sql: str) -> str:
     """Swap SQLite '?' placeholders to Postgres '%s' when needed."""
     return sql.replace("?", "%s") if IS_PG else sql
 
+# column order shared by the upsert SQL and the record → tuple conversion
+_CAR_COLUMNS = (
+    "listing_id", "title", "url", "city", "region", "seller_type",
+    "price", "currency", "brand", "fuel", "model_year", "mileage_km",
+)
+
 # --- SQL (two small variants: only placeholders + now() differ)
 _UPSERT_SQL_SQLITE = """
 INSERT INTO cars (listing_id, title, url, city, region, seller_type,
-                  price, currency, brand, fuel, model_year, mileage_km)
-VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                  price, currency, brand, fuel, model_year, mileage_km,
+                  region_id)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
 ON CONFLICT(listing_id) DO UPDATE SET
   title=excluded.title,
   url=excluded.url,
@@ -38,13 +55,15 @@ ON CONFLICT(listing_id) DO UPDATE SET
   fuel=excluded.fuel,
   model_year=excluded.model_year,
   mileage_km=excluded.mileage_km,
+  region_id=excluded.region_id,
   scraped_at=datetime('now');
 """
 
 _UPSERT_SQL_PG = """
 INSERT INTO cars (listing_id, title, url, city, region, seller_type,
-                  price, currency, brand, fuel, model_year, mileage_km)
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                  price, currency, brand, fuel, model_year, mileage_km,
+                  region_id)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
 ON CONFLICT (listing_id) DO UPDATE SET
   title=EXCLUDED.title,
   url=EXCLUDED.url,
@@ -57,6 +76,7 @@ ON CONFLICT (listing_id) DO UPDATE SET
   fuel=EXCLUDED.fuel,
   model_year=EXCLUDED.model_year,
   mileage_km=EXCLUDED.mileage_km,
+  region_id=EXCLUDED.region_id,
   scraped_at=NOW();
 """
 
@@ -72,51 +92,63 @@ def _ensure_region_column(con):
     if "region_id" not in cols:
         con.execute("ALTER TABLE cars ADD COLUMN region_id INTEGER;")
         con.execute("CREATE INDEX IF NOT EXISTS cars_region_id_idx ON cars(region_id);")
+    # partial index: the backfill SELECT scans only the unresolved rows
+    con.execute("CREATE INDEX IF NOT EXISTS cars_region_id_null_idx "
+                "ON cars(region_id) WHERE region_id IS NULL;")
+
+_SLUG_RE = re.compile(r"[^a-z0-9]+")
 
 def _slug(s: str) -> str:
     s = unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode("ascii")
-    return re.sub(r"[^a-z0-9]+", " ", s.lower()).strip()
+    return _SLUG_RE.sub(" ", s.lower()).strip()
+
+# regions/region_aliases change essentially never during a scrape, so both
+# lookup shapes — exact name/alias dict and the slug list for the loose
+# contains fallback — are loaded once per process; memoized results keep
+# repeat (city, region) pairs from touching SQL at all
+_REGION_LOOKUP = None
+_RESOLVE_CACHE: dict = {}
+
+def _region_lookup(con):
+    global _REGION_LOOKUP
+    if _REGION_LOOKUP is None:
+        exact = {}
+        slugs = []
+        for rid, name in con.execute(
+                "SELECT id, name FROM regions WHERE level='district'"):
+            exact.setdefault(name.lower(), rid)
+            slugs.append((_slug(name), rid))
+        for rid, alias in con.execute(
+                "SELECT region_id, alias FROM region_aliases"):
+            exact.setdefault(alias.lower(), rid)
+            slugs.append((_slug(alias), rid))
+        _REGION_LOOKUP = (exact, slugs)
+    return _REGION_LOOKUP
 
 def resolve_region_id(con, city: str | None, region: str | None):
     """
     Resolve a scraped (city/region) string to a canonical district region_id.
-    Tries: alias exact → name exact → loose slug contains.
+    Tries: exact name/alias (in-process dict) → loose slug contains (a scan
+    over the ~25 known slugs; `in` is a C substring search).
     """
     cand = (region or city or "").strip()
     if not cand:
         return None
+    key = cand.lower()
+    if key in _RESOLVE_CACHE:
+        return _RESOLVE_CACHE[key]
 
-    row = con.execute(_q("""
-        SELECT r.id
-        FROM region_aliases a
-        JOIN regions r ON r.id = a.region_id
-        WHERE lower(a.alias) = ?
-        LIMIT 1
-    """), (cand.lower(),)).fetchone()
-    if row:
-        return row[0]
-
-    row = con.execute(_q("""
-        SELECT id
-        FROM regions
-        WHERE level='district' AND lower(name) = ?
-        LIMIT 1
-    """), (cand.lower(),)).fetchone()
-    if row:
-        return row[0]
-
-    s = _slug(cand)
-    row = con.execute(_q("""
-        WITH c AS (
-          SELECT r.id, lower(r.name) AS n FROM regions r WHERE r.level='district'
-          UNION ALL
-          SELECT a.region_id AS id, lower(a.alias) AS n FROM region_aliases a
-        )
-        SELECT id FROM c
-        WHERE %s LIKE '%%' || n || '%%'
-        LIMIT 1
-    """), (s,) if IS_PG else (s,)).fetchone()
-    return row[0] if row else None
+    exact, slugs = _region_lookup(con)
+    rid = exact.get(key)
+    if rid is None:
+        s = _slug(cand)
+        for slug, slug_rid in slugs:
+            if slug and slug in s:
+                rid = slug_rid
+                break
+
+    _RESOLVE_CACHE[key] = rid
+    return rid
 
 def _seed_districts(con):
     if IS_PG:
@@ -159,49 +191,76 @@ def _seed_districts(con):
       SELECT id, 'Vila-Real' FROM regions WHERE level='district' AND name='Vila Real';
     """)
 
+# the DDL/seed scripts are idempotent but not free (executescript parses the
+# whole schema each time); run them once per process on the write path
+_SCHEMA_READY = False
+
+def _ensure_write_schema(con):
+    global _SCHEMA_READY
+    if _SCHEMA_READY:
+        return
+    _ensure_schema(con)
+    _ensure_region_column(con)
+    _seed_districts(con)
+    _SCHEMA_READY = True
+
 def backfill_cars_region_ids():
     con = connect()
-    updated = 0
     with con:
-        _ensure_schema(con)
-        _ensure_region_column(con)
-        for lid, city, region in con.execute("SELECT listing_id, city, region FROM cars WHERE region_id IS NULL"):
+        _ensure_write_schema(con)
+        rows = con.execute(
+            "SELECT listing_id, city, region FROM cars WHERE region_id IS NULL"
+        ).fetchall()
+        pairs = []
+        for lid, city, region in rows:
             rid = resolve_region_id(con, city, region)
             if rid is not None:
-                con.execute(_q("UPDATE cars SET region_id = ? WHERE listing_id = ?"),
-                            (rid, lid) if not IS_PG else (rid, lid))
-                updated += 1
-    return updated
+                pairs.append((rid, lid))
+        if pairs:
+            # one bulk statement instead of one UPDATE per resolved row
+            if IS_PG:
+                con.cursor().executemany(
+                    _q("UPDATE cars SET region_id = ? WHERE listing_id = ?"), pairs)
+            else:
+                con.executemany(
+                    "UPDATE cars SET region_id = ? WHERE listing_id = ?", pairs)
+    return len(pairs)
 
 def save_cars(records):
     con = connect()
     upsert_sql = _UPSERT_SQL_PG if IS_PG else _UPSERT_SQL_SQLITE
-    with con:  # auto-commit/rollback
-        _ensure_schema(con)
-        _ensure_region_column(con)
-        _seed_districts(con)
-        upserted = 0
-        for rec in records:
-            lid = rec.get("listing_id") or rec.get("url")
-            if not lid:
-                continue
-            con.execute(upsert_sql, (
-                lid,
-                rec.get("title"),
-                rec.get("url"),
-                rec.get("city"),
-                rec.get("region"),
-                rec.get("seller_type"),
-                rec.get("price"),
-                rec.get("currency"),
-                rec.get("brand"),
-                rec.get("fuel"),
-                rec.get("model_year"),
-                rec.get("mileage_km"),
-            ))
-            upserted += 1
-            rid = resolve_region_id(con, rec.get("city"), rec.get("region"))
-            if rid is not None:
-                con.execute(_q("UPDATE cars SET region_id = ? WHERE listing_id = ?"),
-                            (rid, lid) if not IS_PG else (rid, lid))
-    return upserted
+    # schema/seed maintenance runs in autocommit (executescript commits on
+    # its own anyway); the data writes below get one explicit transaction
+    _ensure_write_schema(con)
+    # region_id rides along in the upsert itself (no follow-up UPDATEs);
+    # scrapes hit a handful of cities, so memoize the resolve per save
+    region_cache = {}
+    rows = []
+    for rec in records:
+        lid = rec.get("listing_id") or rec.get("url")
+        if not lid:
+            continue
+        key = (rec.get("city"), rec.get("region"))
+        if key not in region_cache:
+            region_cache[key] = resolve_region_id(con, *key)
+        rows.append((lid,) + tuple(rec.get(c) for c in _CAR_COLUMNS[1:])
+                    + (region_cache[key],))
+    try:
+        if not IS_PG:
+            # take the write lock up front; the whole batch then commits as
+            # one transaction — a single WAL fsync — instead of sqlite3's
+            # deferred begin upgrading the lock mid-batch
+            con.execute("BEGIN IMMEDIATE")
+        if rows:
+            if IS_PG:
+                # psycopg3 keeps executemany on the cursor, and since 3.1 it
+                # runs the batch in pipeline mode — one network round-trip
+                # for the whole upsert instead of one per row
+                con.cursor().executemany(upsert_sql, rows)
+            else:
+                con.executemany(upsert_sql, rows)
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    return len(rows)
@@ -0,0 +1,501 @@
+# db_helpers.py
+# Cached DB access layer for the Streamlit admin. Lives in its own module so
+# Streamlit's rerun-the-script loop doesn't redefine these functions (and
+# re-register their caches) on every interaction — imported modules are
+# parsed once per process.
+
+import functools
+import sqlite3
+import time
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+from db import DB_PATH, SCHEMA_PATH, connect
+from db import IS_PG
+
+# read the DDL once at import; _ensured() below runs it at most once per
+# process, so ensure_db() is a cache lookup after the first call
+_SCHEMA_SQL = Path(SCHEMA_PATH).read_text(encoding="utf-8") if not IS_PG else ""
+
+# --- shared connection (pragmas applied once, reused across reruns)
+@st.cache_resource(show_spinner=False)
+def get_con():
+    """
+    One DB connection per process instead of connect/close per query.
+    SQLite readers are safe across Streamlit's threads with
+    check_same_thread=False; WAL + mmap let hot reads skip syscalls.
+    """
+    if IS_PG:
+        con = connect()
+        # read path: without autocommit psycopg would open a transaction on
+        # the first query and hold it for the life of the cached connection
+        con.autocommit = True
+        return con
+    con = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    con.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA mmap_size=268435456;"
+        "PRAGMA cache_size=-65536;"
+    )
+    return con
+
+
+# --- ensure DB exists / schema is applied (read-only safe if already there)
+@st.cache_resource(show_spinner=False)
+def _ensured() -> bool:
+    """
+    Apply schema.sql at most once per process, and only when something is
+    actually missing — re-running executescript on every rerun made SQLite
+    parse the whole DDL each time even though it was all IF NOT EXISTS.
+    """
+    if IS_PG:
+        return True  # managed separately with schema_pg.sql
+    con = get_con()
+    have = con.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE name IN ('cars', 'cars_scraped_listing_idx')"
+    ).fetchone()
+    if have[0] < 2:
+        con.executescript(_SCHEMA_SQL)
+    return True
+
+
+def ensure_db():
+    _ensured()
+    return get_con()
+
+# --- small helpers
+@st.cache_data(show_spinner=False)
+def list_tables(mtime: int = 0):
+    # straight off the cursor — going through a DataFrame just to call
+    # .tolist() makes the pandas setup cost dwarf the actual query.
+    # `mtime` versions the cache key so new tables appear after a write.
+    con = get_con()
+    if IS_PG:
+        q = "SELECT tablename FROM pg_catalog.pg_tables WHERE schemaname='public' ORDER BY tablename;"
+    else:
+        q = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name;"
+    return [r[0] for r in con.execute(q).fetchall()]
+
+
+@st.cache_data(show_spinner=False)
+def read_schema_generic(table: str, mtime: int = 0):
+    con = get_con()
+    if IS_PG:
+        cur = con.execute("""
+            SELECT column_name, data_type, is_nullable, column_default
+            FROM information_schema.columns
+            WHERE table_schema='public' AND table_name=%s
+            ORDER BY ordinal_position;
+        """, (table,))
+    else:
+        cur = con.execute(f'PRAGMA table_info("{table}");')
+    rows = cur.fetchall()
+    return pd.DataFrame.from_records(rows, columns=[d[0] for d in cur.description])
+
+
+def _table_columns(table: str) -> list[str]:
+    """Column names of a table, used to validate identifiers in built SQL."""
+    con = get_con()
+    if IS_PG:
+        cur = con.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema='public' AND table_name=%s", (table,))
+    else:
+        cur = con.execute(f'PRAGMA table_info("{table}");')
+    return [r[1] if not IS_PG else r[0] for r in cur.fetchall()]
+
+
+@st.cache_data(show_spinner=False, ttl=600, max_entries=64)
+def read_table_generic(table: str, limit: int = 1000, order_by: str | None = None, order_dir: str = "DESC",
+                       mtime: int = 0, cat_filters=None, num_filters=None, cursor=None,
+                       columns: tuple | None = None, tie_by: str | None = None):
+    """
+    Read rows with the filters applied in the WHERE clause, not in pandas.
+
+    `columns` narrows the projection (default: all); callers should drop
+    long text columns they don't render — they dominate bytes per row.
+    `cat_filters` maps column -> tuple of allowed values (becomes IN (...)),
+    `num_filters` maps column -> (lo, hi) (becomes BETWEEN). Filtering at the
+    source means only matching rows cross the SQL→pandas boundary.
+    `cursor` enables keyset pagination: pass the last seen `order_by` value
+    and the next page starts right past it (constant-time regardless of how
+    deep into the table we are, unlike OFFSET). Pass `tie_by` (a unique-ish
+    column, with `cursor` as a `(order_value, tie_value)` pair) whenever the
+    order column can repeat — scraped_at has one-second resolution and whole
+    batches share a timestamp, so a single-column cursor would skip their
+    remainder. The row-value comparison needs SQLite ≥ 3.15 (Postgres is
+    native).
+    `mtime` only versions the cache key: pass db_mtime() so scrape writes
+    invalidate exactly the stale entries, no manual clear() needed.
+    """
+    con = get_con()
+    ph = "%s" if IS_PG else "?"
+    clauses = []
+    params = []
+    valid = None
+    if columns:
+        valid = set(_table_columns(table))
+        unknown = [c for c in columns if c not in valid]
+        if unknown:
+            raise ValueError(f"unknown columns: {unknown}")
+    if cat_filters or num_filters:
+        if valid is None:
+            valid = set(_table_columns(table))
+        for col, allowed in (cat_filters or {}).items():
+            if col not in valid:
+                raise ValueError(f"unknown column: {col}")
+            if allowed:
+                clauses.append(f"{col} IN ({', '.join([ph] * len(allowed))})")
+                params.extend(allowed)
+        for col, (lo, hi) in (num_filters or {}).items():
+            if col not in valid:
+                raise ValueError(f"unknown column: {col}")
+            clauses.append(f"{col} BETWEEN {ph} AND {ph}")
+            params.extend([lo, hi])
+    if tie_by:
+        if valid is None:
+            valid = set(_table_columns(table))
+        if tie_by not in valid:
+            raise ValueError(f"unknown column: {tie_by}")
+    if cursor is not None:
+        if not order_by:
+            raise ValueError("cursor requires order_by")
+        op = ">" if str(order_dir).upper() == "ASC" else "<"
+        if tie_by:
+            clauses.append(f"({order_by}, {tie_by}) {op} ({ph}, {ph})")
+            params.extend(cursor)
+        else:
+            clauses.append(f"{order_by} {op} {ph}")
+            params.append(cursor)
+    q = f'SELECT {", ".join(columns) if columns else "*"} FROM "{table}"'
+    if clauses:
+        q += " WHERE " + " AND ".join(clauses)
+    if order_by:
+        # the tie column rides along in ORDER BY on every page so the
+        # cursor predicate and the row order always agree
+        q += f" ORDER BY {order_by} {order_dir}"
+        if tie_by:
+            q += f", {tie_by} {order_dir}"
+    q += f" LIMIT {int(limit)}"
+    # raw cursor + from_records: skips pandas' SQL adapter layer and its
+    # per-column dtype inference machinery
+    cur = con.execute(q, params) if params else con.execute(q)
+    rows = cur.fetchall()
+    df = pd.DataFrame.from_records(rows, columns=[d[0] for d in cur.description])
+    # low-cardinality strings become categories: ~8x smaller than object
+    # arrays, and isin/groupby compare integer codes instead of strings
+    for c in df.columns:
+        if df[c].dtype == object and df[c].nunique(dropna=True) <= max(64, len(df) // 10):
+            df[c] = df[c].astype("category")
+    return df
+
+
+@st.cache_data(show_spinner=False)
+def classify_columns(table: str) -> tuple:
+    """
+    (categorical, numeric) column names from the declared SQL types, so the
+    tabs don't re-walk DataFrame dtypes with select_dtypes on every rerun.
+    Declared types are stable per table, hence the unkeyed cache.
+    """
+    con = get_con()
+    if IS_PG:
+        cur = con.execute(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema='public' AND table_name=%s ORDER BY ordinal_position",
+            (table,))
+        pairs = cur.fetchall()
+    else:
+        pairs = [(r[1], r[2]) for r in con.execute(f'PRAGMA table_info("{table}");')]
+    num_kw = ("int", "real", "floa", "doub", "num", "dec")
+    cat_cols = []
+    num_cols = []
+    for name, typ in pairs:
+        t = (typ or "").lower()
+        if any(k in t for k in num_kw):
+            num_cols.append(name)
+        elif "bool" in t or "char" in t or "text" in t or t == "":
+            cat_cols.append(name)
+    return tuple(cat_cols), tuple(num_cols)
+
+
+@st.cache_data(show_spinner=False, ttl=600, max_entries=64)
+def numeric_bounds_generic(table: str, mtime: int, cols: tuple) -> dict:
+    """
+    (min, max) per column over the whole table in one aggregate query. The
+    fetched page is only a LIMIT slice, so ranges derived from it were wrong
+    as soon as the table outgrew the limit.
+    """
+    valid = set(_table_columns(table))
+    unknown = [c for c in cols if c not in valid]
+    if unknown:
+        raise ValueError(f"unknown columns: {unknown}")
+    con = get_con()
+    selects = ", ".join(f"MIN({c}), MAX({c})" for c in cols)
+    row = con.execute(f'SELECT {selects} FROM "{table}"').fetchone()
+    return {c: (row[2 * i], row[2 * i + 1]) for i, c in enumerate(cols)}
+
+
+@st.cache_data(show_spinner=False, ttl=600, max_entries=64)
+def distinct_values_generic(table: str, mtime: int, col: str, cap: int = 500) -> list:
+    """Sorted distinct non-blank values of a column over the whole table."""
+    if col not in _table_columns(table):
+        raise ValueError(f"unknown column: {col}")
+    con = get_con()
+    cur = con.execute(
+        f'SELECT DISTINCT {col} FROM "{table}" '
+        f"WHERE {col} IS NOT NULL AND TRIM({col}) <> '' ORDER BY 1 LIMIT {int(cap)}"
+    )
+    return [r[0] for r in cur.fetchall()]
+
+
+@st.cache_data(show_spinner=False, ttl=600, max_entries=64)
+def cat_options(table: str, mtime: int, cols: tuple) -> dict:
+    """
+    Multiselect options per categorical column, pulled with DISTINCT over the
+    whole table rather than the fetched page, so no value past the LIMIT goes
+    missing from the dropdowns.
+    """
+    return {c: distinct_values_generic(table, mtime, c) for c in cols}
+
+
+# Columns we allow in ORDER BY (anything else would just stall the planner).
+CARS_COLUMNS = (
+    "listing_id", "title", "url", "city", "region", "seller_type",
+    "price", "currency", "brand", "fuel", "model_year", "mileage_km",
+    "scraped_at", "region_id",
+)
+
+# Default projection for the UI: everything the grids/plots actually show.
+# Skipping the long text columns (title) cuts bytes per row noticeably.
+CARS_DISPLAY_COLUMNS = (
+    "listing_id", "brand", "price", "mileage_km", "model_year", "fuel",
+    "city", "region", "seller_type", "url", "scraped_at",
+)
+
+# Compact dtypes for the cars table; repeated strings become categories and
+# numerics avoid the default float64/object inference.
+CARS_DTYPES = {
+    "price": "float32",
+    "mileage_km": "float32",
+    "model_year": "Int16",
+    "brand": "category",
+    "city": "category",
+    "region": "category",
+    "fuel": "category",
+    "seller_type": "category",
+}
+
+
+def _escape_like(value: str) -> str:
+    """Escape LIKE wildcards so user input is matched literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+@functools.lru_cache(maxsize=64)
+def _build_cars_query(columns: tuple, filter_items: tuple, order_by: str | None,
+                      order_dir: str, sample: bool, limit: int) -> str:
+    """
+    SQL text for read_table, memoized on its shape: `filter_items` is
+    (column, match_mode) pairs, so parameter *values* never enter the key.
+    Reruns with different filter text reuse the same string (and the same
+    server-side prepared statement on Postgres).
+
+    Cheap predicates (equality, NULL checks) go first; LIKE patterns last,
+    so SQLite discards most rows before evaluating the expensive ones.
+    """
+    ph = "%s" if IS_PG else "?"
+    q = f"SELECT {', '.join(columns)} FROM cars"
+    eq_clauses = []
+    like_clauses = []
+    for col, mode in filter_items:
+        if mode == "exact":
+            eq_clauses.append(f"{col} = {ph}")
+        elif mode == "prefix":
+            if IS_PG:
+                # no GLOB on Postgres; a prefix LIKE is still index-eligible
+                like_clauses.append(f"{col} LIKE {ph}")
+            else:
+                like_clauses.append(f"{col} GLOB {ph}")
+        else:
+            eq_clauses.append(f"{col} IS NOT NULL")  # drops NULLs before the pattern runs
+            like_clauses.append(f"{col} LIKE {ph} ESCAPE '\\'")
+    clauses = eq_clauses + like_clauses
+    if clauses:
+        q += " WHERE " + " AND ".join(clauses)
+    if sample:
+        # Fibonacci hashing on the rowid shuffles deterministically without
+        # ORDER BY RANDOM()'s fresh sort keys on every call
+        if IS_PG:
+            q += " ORDER BY md5(listing_id)"
+        else:
+            q += " ORDER BY (rowid * 2654435761) % 4294967296"
+    elif order_by:
+        q += f" ORDER BY {order_by} {order_dir}"
+    q += f" LIMIT {int(limit)}"
+    return q
+
+
+@st.cache_resource(show_spinner=False, ttl=300, max_entries=32)
+def read_table(limit=1000, filters=None, order_by=None, order_dir="DESC", columns=None,
+               sample=False, mtime=0):
+    """
+    Read rows from cars with optional per-column filters.
+
+    `mtime` is not used in the query — it versions the cache key. Callers
+    pass db_mtime() so a scrape write invalidates exactly the affected
+    entries instead of requiring a manual cache clear.
+
+    `filters` maps column -> value or (match_mode, value) where match_mode is
+    'exact', 'prefix', or 'contains' (default). Exact/prefix comparisons can
+    use the column indexes; only 'contains' falls back to a LIKE scan.
+    `columns` narrows the projection (defaults to the UI display set).
+    `sample=True` returns a deterministic pseudo-random sample of `limit`
+    rows instead of the first `limit` in insertion order.
+
+    Cached as a resource (no pickle round-trip on hits), so the returned
+    DataFrame is shared across sessions — treat it as read-only and filter
+    with masks/`.loc`, never mutate in place.
+    """
+    if columns is None:
+        columns = CARS_DISPLAY_COLUMNS
+    unknown = [c for c in columns if c not in CARS_COLUMNS]
+    if unknown:
+        raise ValueError(f"unknown columns: {unknown}")
+    con = get_con()
+    # normalize filters to (col, mode) pairs + params in matching order:
+    # the SQL text itself comes out of the lru_cached builder
+    filter_items = []
+    eq_params = []
+    like_params = []
+    if filters:
+        for col, value in filters.items():
+            if isinstance(value, tuple):
+                mode, value = value
+            else:
+                mode = "contains"
+            if not value:
+                continue
+            filter_items.append((col, mode))
+            if mode == "exact":
+                eq_params.append(value)
+            elif mode == "prefix":
+                like_params.append(_escape_like(value) + "%" if IS_PG else value + "*")
+            else:
+                like_params.append(f"%{_escape_like(value)}%")
+    params = eq_params + like_params
+    if order_by and order_by not in CARS_COLUMNS:
+        raise ValueError(f"unknown order_by column: {order_by}")
+    order_dir = "ASC" if str(order_dir).upper() == "ASC" else "DESC"
+    q = _build_cars_query(tuple(columns), tuple(filter_items), order_by,
+                          order_dir, bool(sample), int(limit))
+    # raw cursor + from_records, then one astype to the compact dtypes:
+    # skips pandas' SQL adapter layer and its per-column dtype inference
+    cur = con.execute(q, params) if params else con.execute(q)
+    rows = cur.fetchall()
+    df = pd.DataFrame.from_records(rows, columns=list(columns))
+    dtypes = {c: t for c, t in CARS_DTYPES.items() if c in columns}
+    if dtypes:
+        df = df.astype(dtypes, copy=False)
+    return df
+
+
+def db_mtime() -> int:
+    """
+    Cache-busting key: changes whenever the scraper writes the database.
+
+    In WAL mode a commit lands in scraper.db-wal — the main file's mtime
+    only moves on a checkpoint — so the key is the newest of the two files.
+    On Postgres there is no file to stat; a coarse time bucket keeps the
+    key moving so entries expire within a minute of a write instead of
+    pinning to one value for the life of the process.
+    """
+    if IS_PG:
+        return int(time.time() // 60)
+    newest = 0
+    for p in (Path(DB_PATH), Path(f"{DB_PATH}-wal")):
+        try:
+            newest = max(newest, p.stat().st_mtime_ns)
+        except OSError:
+            pass
+    return newest
+
+
+# Numeric columns of cars that get range sliders.
+CARS_NUMERIC_COLUMNS = ("price", "mileage_km", "model_year")
+
+
+@st.cache_data(show_spinner=False, ttl=300, max_entries=64)
+def numeric_bounds(mtime: int) -> dict:
+    """
+    (min, max) for every numeric cars column in a single aggregate query,
+    memoized per DB write — no rows cross the SQLite→pandas boundary.
+    """
+    con = get_con()
+    selects = ", ".join(f"MIN({c}), MAX({c})" for c in CARS_NUMERIC_COLUMNS)
+    row = con.execute(f"SELECT {selects} FROM cars").fetchone()
+    return {c: (row[2 * i], row[2 * i + 1]) for i, c in enumerate(CARS_NUMERIC_COLUMNS)}
+
+
+@st.cache_data(show_spinner=False, ttl=300, max_entries=64)
+def distinct_values(mtime: int, col: str) -> list:
+    """Sorted distinct non-blank values of a cars column, straight from SQL."""
+    if col not in CARS_COLUMNS:
+        raise ValueError(f"unknown column: {col}")
+    con = get_con()
+    cur = con.execute(
+        f"SELECT DISTINCT {col} FROM cars WHERE {col} IS NOT NULL AND TRIM({col}) <> '' ORDER BY 1"
+    )
+    return [r[0] for r in cur.fetchall()]
+
+
+@st.cache_data(show_spinner=False, ttl=300, max_entries=64)
+def ols_sql(mtime: int, x: str, y: str):
+    """
+    Slope/intercept/R² for y ~ x over the whole cars table in one SQL
+    aggregate scan — OLS only needs five running sums, so no rows are pulled
+    into Python. Returns None when the fit is degenerate.
+    """
+    if x not in CARS_COLUMNS or y not in CARS_COLUMNS:
+        raise ValueError(f"unknown columns: {x}, {y}")
+    con = get_con()
+    row = con.execute(f"""
+        SELECT COUNT(*),
+               SUM({x}), SUM({y}),
+               SUM({x} * {y}), SUM({x} * {x}), SUM({y} * {y})
+        FROM cars
+        WHERE {x} IS NOT NULL AND {y} IS NOT NULL
+    """).fetchone()
+    if not row or not row[0] or row[0] < 2:
+        return None
+    n, sx, sy, sxy, sxx, syy = (float(v) for v in row)
+    denom = n * sxx - sx * sx
+    if denom <= 0:
+        return None
+    m = (n * sxy - sx * sy) / denom
+    b = (sy - m * sx) / n
+    var_y = n * syy - sy * sy
+    r2 = (n * sxy - sx * sy) ** 2 / (denom * var_y) if var_y > 0 else float("nan")
+    return m, b, r2
+
+
+@st.cache_data(show_spinner=False)
+def read_schema():
+    # a handful of rows: raw fetchall + from_records skips the whole
+    # pandas SQL machinery that read_sql_query drags in
+    con = get_con()
+    if IS_PG:
+        cur = con.execute("""
+            SELECT column_name, data_type, is_nullable, column_default
+            FROM information_schema.columns
+            WHERE table_schema='public' AND table_name='cars'
+            ORDER BY ordinal_position;
+        """)
+    else:
+        cur = con.execute("PRAGMA table_info(cars);")
+    rows = cur.fetchall()
+    cols = [d[0] for d in cur.description]
+    return pd.DataFrame.from_records(rows, columns=cols)
@@ -17,6 +17,22 @@ CREATE TABLE IF NOT EXISTS cars (
   scraped_at   TEXT DEFAULT (datetime('now'))
 );
 
+-- single-column indexes for the admin filter/order workload
+CREATE INDEX IF NOT EXISTS cars_brand_idx       ON cars(brand);
+CREATE INDEX IF NOT EXISTS cars_city_idx        ON cars(city);
+CREATE INDEX IF NOT EXISTS cars_fuel_idx        ON cars(fuel);
+CREATE INDEX IF NOT EXISTS cars_seller_type_idx ON cars(seller_type);
+CREATE INDEX IF NOT EXISTS cars_scraped_at_idx  ON cars(scraped_at DESC);
+CREATE INDEX IF NOT EXISTS cars_price_idx       ON cars(price);
+
+-- composite/expression indexes: ORDER BY scraped_at streams straight off
+-- the index under a brand filter, and city matches case-insensitively
+CREATE INDEX IF NOT EXISTS cars_brand_scraped_idx ON cars(brand, scraped_at DESC);
+CREATE INDEX IF NOT EXISTS cars_city_nocase_idx   ON cars(city COLLATE NOCASE);
+
+-- keyset pagination on scraped_at (listing_id breaks ties)
+CREATE INDEX IF NOT EXISTS cars_scraped_listing_idx ON cars(scraped_at DESC, listing_id);
+
 -- --- canonical regions (districts) --------------------------------
 CREATE TABLE IF NOT EXISTS regions (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
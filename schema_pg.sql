@@ -20,6 +20,25 @@ CREATE TABLE IF NOT EXISTS cars (
 
 CREATE INDEX IF NOT EXISTS cars_region_id_idx ON cars(region_id);
 
+-- partial index: the region backfill scans only the unresolved rows
+CREATE INDEX IF NOT EXISTS cars_region_id_null_idx
+  ON cars(region_id) WHERE region_id IS NULL;
+
+-- single-column indexes for the admin filter/order workload
+CREATE INDEX IF NOT EXISTS cars_brand_idx       ON cars(brand);
+CREATE INDEX IF NOT EXISTS cars_city_idx        ON cars(city);
+CREATE INDEX IF NOT EXISTS cars_fuel_idx        ON cars(fuel);
+CREATE INDEX IF NOT EXISTS cars_seller_type_idx ON cars(seller_type);
+CREATE INDEX IF NOT EXISTS cars_scraped_at_idx  ON cars(scraped_at DESC);
+CREATE INDEX IF NOT EXISTS cars_price_idx       ON cars(price);
+
+-- composite/expression indexes for filtered ORDER BY and case-insensitive city
+CREATE INDEX IF NOT EXISTS cars_brand_scraped_idx ON cars(brand, scraped_at DESC);
+CREATE INDEX IF NOT EXISTS cars_city_lower_idx    ON cars(lower(city));
+
+-- keyset pagination on scraped_at (listing_id breaks ties)
+CREATE INDEX IF NOT EXISTS cars_scraped_listing_idx ON cars(scraped_at DESC, listing_id);
+
 -- === canonical regions (districts) ======================================
 CREATE TABLE IF NOT EXISTS regions (
   id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
@@ -3,25 +3,45 @@
 
 from __future__ import annotations
 import argparse
+import asyncio
+import os
 import random
 import re
 import sys
-import time
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional, List, Dict
 from urllib.parse import urljoin
 
+import aiohttp
+import lxml.html
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from requests.adapters import HTTPAdapter, Retry
 
 from db import save_cars  # writes to scraper.db and ensures schema on write
 
 BASE = "https://www.standvirtual.com"
 
+# one keep-alive session for the sync fetch path: the TLS handshake is paid
+# once instead of per page, and retries/backoff come with it
+SESSION = requests.Session()
+SESSION.headers.update({
+    "User-Agent": "Mozilla/5.0 (compatible; StandvirtualScraper/1.0)",
+    "Accept-Encoding": "gzip, br",
+})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=0.5),
+))
+
 # --------- regex helpers ----------
-ID_RE = re.compile(r"ID([^.\/]+)\.html", re.I)
-INT_RE = re.compile(r"\d[\d .]*")
-CM3_RE = re.compile(r"(\d[\d .]*)\s*cm3", re.I)
-CV_RE  = re.compile(r"(\d[\d .]*)\s*cv\b", re.I)
+# re.ASCII: these fields only ever carry ASCII digits/units, so the engine
+# skips Unicode digit/word classification per character
+INT_RE = re.compile(r"\d[\d .]*", re.ASCII)
+CM3_RE = re.compile(r"(\d[\d .]*)\s*cm3", re.I | re.ASCII)
+CV_RE  = re.compile(r"(\d[\d .]*)\s*cv\b", re.I | re.ASCII)
+SELLER_RE = re.compile(r"Profissional|Particular")
+LOC_RE = re.compile(r"^\s*([^()]+?)(?:\s*\(([^)]+)\))?\s*$")  # "City (Region)"
 
 # A tiny set of common multiword brand prefixes to improve brand extraction from title.
 MULTIWORD_BRANDS = [
@@ -32,103 +52,188 @@ MULTIWORD_BRANDS = [
     "ford", "suzuki"
 ]
 
+# precomputed (prefix, brand length) pairs: the trailing space and the slice
+# length are built once here instead of allocating "b + ' '" per card, and
+# the descending-length sort makes "mercedes benz" win over "mercedes"
+_BRAND_PREFIXES = tuple(
+    (b + " ", len(b)) for b in sorted(MULTIWORD_BRANDS, key=len, reverse=True)
+)
+
+# strips thousands separators (" " and ".") in one C-level pass
+_THOUSANDS = str.maketrans("", "", " .")
+
 def _to_int(text: Optional[str]) -> Optional[int]:
     if not text:
         return None
-    s = str(text).replace(" ", "").replace(".", "")
     try:
-        return int(s)
+        return int(str(text).translate(_THOUSANDS))
     except ValueError:
         return None
 
+def _to_int_norm(x) -> Optional[int]:
+    # save-time variant: also accepts values already parsed to int/None
+    try:
+        return int(str(x).translate(_THOUSANDS))
+    except (TypeError, ValueError):
+        return None
+
 def fetch_html(max_price: Optional[int] = None, page: int = 1) -> str:
     url = f"{BASE}/carros"
     params = {"page": page}
     if max_price is not None:
         params["search[filter_float_price:to]"] = max_price
-    r = requests.get(
+    r = SESSION.get(url, params=params, timeout=30)
+    r.raise_for_status()
+    # the site serves UTF-8; declaring it skips chardet's per-response guess
+    # (which dominates .text when no charset header is present)
+    r.encoding = "utf-8"
+    return r.text
+
+async def fetch_html_async(session: aiohttp.ClientSession, max_price: Optional[int] = None, page: int = 1) -> str:
+    url = f"{BASE}/carros"
+    params = {"page": page}
+    if max_price is not None:
+        params["search[filter_float_price:to]"] = max_price
+    async with session.get(
         url,
         params=params,
         headers={"User-Agent": "Mozilla/5.0 (compatible; StandvirtualScraper/1.0)"},
-        timeout=30,
-    )
-    r.raise_for_status()
-    return r.text
+        timeout=aiohttp.ClientTimeout(total=30),
+    ) as r:
+        r.raise_for_status()
+        return await r.text(encoding="utf-8")
+
+async def _scrape_pages(max_price, total_pages, polite_delay, on_progress) -> Dict[int, List[Dict]]:
+    """
+    Fetch all result pages concurrently (politely bounded) and parse each one
+    the moment it lands, so DOM parsing overlaps the remaining downloads
+    instead of waiting for the slowest page. Returns {page: records}.
+    """
+    sem = asyncio.Semaphore(3)  # at most 3 in-flight requests against the site
+    parsed: Dict[int, List[Dict]] = {}
+    done = 0
+    loop = asyncio.get_running_loop()
+    # parse_page is pure CPU (tree walk + regex) and would block the loop;
+    # running it in worker processes lets page N+1 download while page N
+    # parses on another core
+    pool = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+
+    async def fetch(session, page):
+        nonlocal done
+        async with sem:
+            if page > 1:
+                await asyncio.sleep(random.uniform(*polite_delay))
+            html = await fetch_html_async(session, max_price=max_price, page=page)
+        parsed[page] = await loop.run_in_executor(pool, parse_page, html)
+        done += 1
+        on_progress(done, total_pages)
 
-def _find_result_cards(soup: BeautifulSoup):
-    """Prefer stable anchors. Fallback to URL pattern if needed."""
-    container = soup.select_one('[data-testid="search-results"]')
-    if not container:
+    try:
+        connector = aiohttp.TCPConnector(limit=16, limit_per_host=8)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await asyncio.gather(*(fetch(session, p) for p in range(1, total_pages + 1)))
+    finally:
+        pool.shutdown()
+    return parsed
+
+# compiled once: each call is a single C-level tree walk instead of a
+# Python-side bs4-style traversal per field
+_X_CONTAINER = etree.XPath('//*[@data-testid="search-results"]')
+_X_ARTICLES = etree.XPath('.//article')
+_X_ANCHOR = etree.XPath('(.//a[@href])[1]')
+_X_TITLE_EL = etree.XPath('(.//h2 | .//h3)[1]')
+_X_DDS = etree.XPath('.//dd[@data-parameter]')
+_X_DLS = etree.XPath('.//dl')
+_X_PS = etree.XPath('.//p')
+_X_H3S = etree.XPath('.//h3')
+_X_NEXT_P = etree.XPath('following::p[1]')
+_X_SIBLING_P = etree.XPath('following-sibling::p[1]')
+
+def _text(el) -> str:
+    # whitespace-normalized text content (get_text(" ", strip=True) analogue)
+    return " ".join(el.text_content().split())
+
+def _find_result_cards(doc):
+    """Prefer stable anchors. Fallback to URL pattern if needed.
+
+    Returns (article, anchor) pairs — the listing link is already resolved
+    here, so extraction doesn't repeat the same lookup per card.
+    """
+    containers = _X_CONTAINER(doc)
+    if not containers:
         return []
     # Many pages include non-listing tiles; keep only those with a listing-like link.
-    articles = container.find_all("article")
     cards = []
-    for art in articles:
-        a = art.find("a", href=True)
-        if not a:
+    for art in _X_ARTICLES(containers[0]):
+        anchors = _X_ANCHOR(art)
+        if not anchors:
             continue
-        href = a["href"]
+        a = anchors[0]
+        href = a.get("href")
         if "/carros/anuncio/" in href and "ID" in href and href.endswith(".html"):
-            cards.append(art)
+            cards.append((art, a))
     return cards
 
-def _extract_title(art) -> Optional[str]:
-    h = art.find(["h2", "h3"])
-    return h.get_text(strip=True) if h else None
-
-def _extract_url_and_id(art):
-    a = art.find("a", href=True)
-    if not a:
-        return None, None
-    url = urljoin(BASE, a["href"])
-    m = ID_RE.search(url or "")
-    return url, (m.group(1) if m else None)
-
-def _extract_specs_line(art):
+def _extract_title(title_el) -> Optional[str]:
+    return _text(title_el) or None if title_el is not None else None
+
+def _extract_url_and_id(a):
+    url = urljoin(BASE, a.get("href"))
+    # listing URLs end in "ID{id}.html" — a fixed suffix, so plain string
+    # ops replace the old ID_RE search
+    _, sep, tail = url.rpartition("ID")
+    if sep and tail.endswith(".html"):
+        lid = tail[:-5]
+        if lid and "." not in lid and "/" not in lid:
+            return url, lid
+    return url, None
+
+def _extract_specs_line(title_el):
     # Short line under title like "1998 cm3 • 130 cv"
-    title_el = art.find(["h2", "h3"])
-    p = title_el.parent.find_next("p") if title_el else None
-    return p.get_text(" ", strip=True) if p else ""
+    ps = _X_NEXT_P(title_el) if title_el is not None else []
+    return _text(ps[0]) if ps else ""
+
+# dd[data-parameter] names we keep: mileage ("180 000 km"), fuel_type
+# ("Diesel"), gearbox ("Manual"), first_registration_year
+_PARAM_KEYS = ("mileage", "fuel_type", "gearbox", "first_registration_year")
 
 def _extract_params(art) -> Dict[str, Optional[str]]:
-    def param(name: str) -> Optional[str]:
-        dd = art.select_one(f'dd[data-parameter="{name}"]')
-        return dd.get_text(" ", strip=True) if dd else None
-    return {
-        "mileage": param("mileage"),                             # e.g. "180 000 km"
-        "fuel_type": param("fuel_type"),                         # e.g. "Diesel"
-        "gearbox": param("gearbox"),                             # e.g. "Manual"
-        "first_registration_year": param("first_registration_year"),
-    }
+    # one walk over the card's tagged <dd> elements instead of a query per key
+    params = dict.fromkeys(_PARAM_KEYS)
+    for dd in _X_DDS(art):
+        name = dd.get("data-parameter")
+        if name in params and params[name] is None:
+            params[name] = _text(dd)
+    return params
 
 def _extract_location_and_seller(art):
     # On the provided HTML, location/seller live in the second <dl>
-    dls = art.find_all("dl")
+    dls = _X_DLS(art)
     city = region = seller_type = None
     if len(dls) >= 2:
-        loc_p = dls[1].find("p")
-        if loc_p:
-            loc = loc_p.get_text(strip=True)
-            m = re.match(r"^\s*([^()]+?)(?:\s*\(([^)]+)\))?\s*$", loc)
+        ps = _X_PS(dls[1])
+        if ps:
+            loc = _text(ps[0])
+            m = LOC_RE.match(loc)
             if m:
                 city = (m.group(1) or "").strip() or None
                 region = (m.group(2) or "").strip() if m.group(2) else None
-        ps = dls[1].find_all("p")
         if len(ps) >= 2:
-            stxt = ps[1].get_text(" ", strip=True)
-            seller_type = "Profissional" if "Profissional" in stxt else ("Particular" if "Particular" in stxt else None)
+            stxt = _text(ps[1])
+            m = SELLER_RE.search(stxt)
+            seller_type = m.group(0) if m else None
     return city, region, seller_type
 
 def _extract_price_currency(art):
     price = currency = None
-    for h3 in art.find_all("h3"):
-        text = h3.get_text(strip=True)
+    for h3 in _X_H3S(art):
+        text = _text(h3)
         m = INT_RE.search(text)
         if m:
             price = _to_int(m.group(0))
-            pcur = h3.find_next_sibling("p")
+            pcur = _X_SIBLING_P(h3)
             if pcur:
-                currency = pcur.get_text(strip=True)
+                currency = _text(pcur[0])
             break
     if price is not None and not currency:
         currency = "EUR"
@@ -138,23 +243,30 @@ def _extract_brand_from_title(title: Optional[str]) -> Optional[str]:
     if not title:
         return None
     low = title.lower()
-    # check multiword brands first
-    for b in MULTIWORD_BRANDS:
-        if low.startswith(b + " "):
+    # check multiword brands first (longest prefix wins)
+    for prefix, n in _BRAND_PREFIXES:
+        if low.startswith(prefix):
             # return the exact substring from the original title (preserve casing), as a STRING
-            return title[:len(b)]
+            return title[:n]
     # else take the first token
     return title.split()[0]
 
 
 def parse_page(html: str) -> List[Dict]:
-    soup = BeautifulSoup(html, "html.parser")
-    cards = _find_result_cards(soup)
+    # cheap byte scan before tokenizing: empty/anti-bot shells don't carry
+    # the results container, so skip building a tree for them entirely
+    if 'data-testid="search-results"' not in html:
+        return []
+    doc = lxml.html.fromstring(html)
+    cards = _find_result_cards(doc)
     out: List[Dict] = []
 
-    for art in cards:
-        url, listing_id = _extract_url_and_id(art)
-        title = _extract_title(art)
+    for art, a in cards:
+        url, listing_id = _extract_url_and_id(a)
+        # the title heading is used twice (title + specs line); find it once
+        title_els = _X_TITLE_EL(art)
+        title_el = title_els[0] if title_els else None
+        title = _extract_title(title_el)
         city, region, seller_type = _extract_location_and_seller(art)
         price, currency = _extract_price_currency(art)
 
@@ -168,7 +280,7 @@ def parse_page(html: str) -> List[Dict]:
         model_year = _to_int(params["first_registration_year"]) if params["first_registration_year"] else None
 
         # Specs line (optional): "1998 cm3 • 130 cv" — currently not stored in DB, but parseable if needed
-        specs = _extract_specs_line(art)
+        specs = _extract_specs_line(title_el)
         # cm3 = _to_int(CM3_RE.search(specs).group(1)) if CM3_RE.search(specs) else None
         # cv  = _to_int(CV_RE.search(specs).group(1)) if CV_RE.search(specs) else None
 
@@ -192,60 +304,57 @@ def parse_page(html: str) -> List[Dict]:
 
     return out
 
-def _normalize_and_dedupe(records: List[Dict]) -> List[Dict]:
-    # de-dupe by listing_id (fallback to URL) + normalize numeric fields
+def _iter_clean(records):
+    # de-dupe by listing_id (fallback to URL) + normalize numeric fields.
+    # Generator: save_cars consumes it in one pass, so the cleaned records
+    # never materialize as a second list next to the raw one.
     seen = set()
-    cleaned = []
     for r in records:
         key = r.get("listing_id") or r.get("url")
         if not key or key in seen:
             continue
         seen.add(key)
-
-        def to_int(x):
-            try:
-                return int(str(x).replace(".", "").replace(" ", ""))
-            except Exception:
-                return None
-
-        r["price"] = to_int(r.get("price"))
-        r["model_year"] = to_int(r.get("model_year"))
-        r["mileage_km"] = to_int(r.get("mileage_km"))
-        cleaned.append(r)
-    return cleaned
+        r["price"] = _to_int_norm(r.get("price"))
+        r["model_year"] = _to_int_norm(r.get("model_year"))
+        r["mileage_km"] = _to_int_norm(r.get("mileage_km"))
+        yield r
 
 def run_scrape(max_price: int = 15000, pages: int = 2, polite_delay=(1, 4), on_progress=None):
     """Fetch N pages, parse DOM, normalize, upsert to DB, return a small summary dict."""
     if on_progress is None:
         on_progress = lambda i, total: None  # no-op
 
-    all_recs: List[Dict] = []
-    pages_fetched = 0
     total_pages = int(pages)
+    pages_recs = asyncio.run(_scrape_pages(max_price, total_pages, polite_delay, on_progress))
 
+    # Collect in page order; stop at the first empty page (end of results).
+    all_recs: List[Dict] = []
+    pages_fetched = 0
     for p in range(1, total_pages + 1):
-        html = fetch_html(max_price=max_price, page=p)
-        recs = parse_page(html)
-
-        on_progress(p, total_pages)  # move UI even if empty
+        recs = pages_recs[p]
         if not recs:
             break
-
         all_recs.extend(recs)
         pages_fetched += 1
 
-        time.sleep(random.uniform(*polite_delay))
-
-    cleaned = _normalize_and_dedupe(all_recs)
-    upserted = save_cars(cleaned)
+    # save_cars takes any iterable and streams it into its batch
+    upserted = save_cars(_iter_clean(all_recs))
     return {
         "pages_fetched": pages_fetched,
         "raw_records": len(all_recs),
-        "cleaned_records": len(cleaned),
+        "cleaned_records": upserted,  # everything cleaned is upserted
         "upserted": upserted,
     }
 
 def main():
+    # CLI only: swap in uvloop's event loop when available (the page fetches
+    # run under asyncio.run). Streamlit invokes run_scrape directly, so the
+    # policy is installed here rather than at import.
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     MAX_PRICE = 10000
     PAGES = 2
     summary = run_scrape(max_price=MAX_PRICE, pages=PAGES)